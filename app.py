@@ -0,0 +1,48 @@
+from io import BytesIO
+
+from flask import Flask, render_template, request, jsonify, send_file
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from simulation import Chip
+
+app = Flask(__name__)
+
+
+@app.route("/")
+def index():
+    return render_template("index.html")
+
+
+@app.route("/calculate_focal_length", methods=["POST"])
+def calculate_focal_length():
+    data = request.get_json()
+    chip = Chip(np.asarray(data["spacings"], dtype=np.float64),
+                np.asarray(data["thicknesses"], dtype=np.float64))
+    voltages = np.asarray(data["voltages"], dtype=np.float64)
+    focal_length = chip.get_system_focal_length(voltages)
+    return jsonify({"focal_length": float(focal_length)})
+
+
+@app.route("/plot_ray", methods=["POST"])
+def plot_ray():
+    data = request.get_json()
+    chip = Chip(np.asarray(data["spacings"], dtype=np.float64),
+                np.asarray(data["thicknesses"], dtype=np.float64))
+    voltages = np.asarray(data["voltages"], dtype=np.float64)
+    fig = Figure(figsize=(6, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    chip.plot_custom_ray(data["angle"], data["offset"], data["energy"],
+                         voltages, ax=ax)
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    buf.seek(0)
+    return send_file(buf, mimetype="image/png")
+
+
+if __name__ == "__main__":
+    app.run(debug=False, threaded=True, port=5000)
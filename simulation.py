@@ -0,0 +1,303 @@
+import math
+import warnings
+from functools import lru_cache
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _propagate(spacings, voltages, focal_lengths, angle, offset, energy):
+    """Trace one ray through the aperture stack (compiled hot loop).
+
+    Inlines the gap and thin-lens transforms so the whole propagation runs
+    as native code with no per-aperture Python dispatch. Falls back to the
+    plain Python version when numba is not installed.
+    """
+    n = spacings.shape[0]
+    deflections = np.empty(n + 1)
+    offsets = np.empty(n + 1)
+    deflections[0] = angle
+    offsets[0] = offset
+    for i in range(n):
+        vL = voltages[i] - voltages[0] + energy
+        vR = voltages[i + 1] - voltages[0] + energy
+        if vR <= 0.0 or vL <= 0.0:
+            # ray is decelerated to a stop in the gap; treat the rest of
+            # the gap as a plain drift (same as transform_deflection_gap)
+            new_deflection = 0.0
+            new_offset = offsets[i] + deflections[i] * spacings[i]
+        else:
+            voltage_ratio = math.sqrt(vL / vR)
+            new_deflection = deflections[i] * voltage_ratio
+            new_offset = offsets[i] + deflections[i] * 2.0 * spacings[i] / (1.0 / voltage_ratio + 1.0)
+        focal_length = focal_lengths[i]
+        # inf entries are fine here (new_offset / inf == 0), but f == 0 is
+        # an infinitely strong lens: off-axis rays get an explicit infinite
+        # kick, on-axis rays pass straight through
+        if focal_length != 0.0:
+            new_deflection -= new_offset / focal_length
+        elif new_offset > 0.0:
+            new_deflection = -math.inf
+        elif new_offset < 0.0:
+            new_deflection = math.inf
+        deflections[i + 1] = new_deflection
+        offsets[i + 1] = new_offset
+    return deflections, offsets
+
+
+def _propagate_fused(spacings, voltages, angle, offset, energy):
+    """Like _propagate, but computes each focal length inline.
+
+    The focal lengths are consumed in exactly the order they are produced,
+    so fusing the two loops avoids materializing the intermediate
+    focal-length array and a second pass over it.
+    """
+    n = spacings.shape[0]
+    deflections = np.empty(n + 1)
+    offsets = np.empty(n + 1)
+    deflections[0] = angle
+    offsets[0] = offset
+    for i in range(n):
+        vL = voltages[i] - voltages[0] + energy
+        vR = voltages[i + 1] - voltages[0] + energy
+        if vR <= 0.0 or vL <= 0.0:
+            # ray is decelerated to a stop in the gap; treat the rest of
+            # the gap as a plain drift (same as transform_deflection_gap)
+            new_deflection = 0.0
+            new_offset = offsets[i] + deflections[i] * spacings[i]
+        else:
+            voltage_ratio = math.sqrt(vL / vR)
+            new_deflection = deflections[i] * voltage_ratio
+            new_offset = offsets[i] + deflections[i] * 2.0 * spacings[i] / (1.0 / voltage_ratio + 1.0)
+        E_left = (voltages[i + 1] - voltages[i]) / spacings[i]
+        if i == n - 1:
+            E_right = 0.0
+        else:
+            E_right = (voltages[i + 2] - voltages[i + 1]) / spacings[i + 1]
+        denominator = E_right - E_left
+        # no net field gradient means no lensing: skip the kick outright
+        # rather than dividing by an inf sentinel
+        if denominator != 0.0:
+            focal_length = -4.0 * (voltages[i + 1] - voltages[0]) / denominator
+            if focal_length != 0.0:
+                new_deflection -= new_offset / focal_length
+            # f == 0 (electrode at source potential) is an infinitely
+            # strong lens: off-axis rays get an infinite kick, on-axis
+            # rays pass straight through
+            elif new_offset > 0.0:
+                new_deflection = -math.inf
+            elif new_offset < 0.0:
+                new_deflection = math.inf
+        deflections[i + 1] = new_deflection
+        offsets[i + 1] = new_offset
+    return deflections, offsets
+
+
+if numba is not None:
+    # no fastmath: the kernels rely on IEEE semantics for infinite focal
+    # lengths (new_offset / inf == 0 in _propagate's cached-array path)
+    _propagate = numba.njit(cache=True)(_propagate)
+    _propagate_fused = numba.njit(cache=True)(_propagate_fused)
+    # compile at import time so the first web request doesn't pay JIT latency
+    _propagate(np.ones(1), np.ones(2), np.ones(1), 0.0, 0.0, 1.0)
+    _propagate_fused(np.ones(1), np.ones(2), 0.0, 0.0, 1.0)
+
+
+class Chip:
+    """An einzel lens chip: a stack of charged apertures along the beam axis.
+
+    spacings[i] is the gap in front of aperture i, thicknesses[i] is the
+    thickness of aperture i. Voltages are given as [source, aperture 1, ...,
+    aperture n], so len(voltages) == len(spacings) + 1.
+    """
+
+    def __init__(self, spacings, thicknesses):
+        self.spacings = np.asarray(spacings, dtype=np.float64)
+        self.thicknesses = thicknesses
+        # geometry constants reused by the path sampler and the plots
+        self._cum_spacings = np.concatenate(([0.0], np.cumsum(self.spacings)))
+        self._total_length = float(self._cum_spacings[-1])
+
+    def get_aperture_focal_length(self, aperture_index, voltages):
+        """Focal length of a single aperture in the paraxial approximation."""
+        base_voltage = voltages[0]
+        lens_voltage = voltages[aperture_index + 1]
+        E_left = (lens_voltage - voltages[aperture_index]) / self.spacings[aperture_index]
+        if aperture_index == len(self.spacings) - 1:
+            # last aperture sits on the substrate, field-free region behind it
+            E_right = 0
+        else:
+            E_right = (voltages[aperture_index + 2] - lens_voltage) / self.spacings[aperture_index + 1]
+        denominator = E_right - E_left
+        if denominator == 0.0:
+            # no net field gradient across the aperture, so no lensing
+            return math.inf
+        return -4 * (lens_voltage - base_voltage) / denominator
+
+    def get_all_focal_lengths(self, voltages):
+        """Focal lengths of every aperture, computed in one vectorized pass.
+
+        Results are cached per voltage configuration, since both the ray
+        tracer and the system focal length ask for the same set.
+        """
+        return self._focal_lengths_cached(tuple(voltages))
+
+    @lru_cache(maxsize=32)
+    def _focal_lengths_cached(self, voltages_tuple):
+        V = np.asarray(voltages_tuple, dtype=np.float64)
+        d = self.spacings
+        E_left = (V[1:] - V[:-1]) / d
+        # behind the last aperture the region is field-free, so E_right = 0
+        E_right = np.concatenate(((V[2:] - V[1:-1]) / d[1:], [0.0]))
+        denominator = E_right - E_left
+        # no net field gradient means no lensing, same as the scalar path
+        with np.errstate(divide="ignore", invalid="ignore"):
+            focal_lengths = np.where(denominator == 0.0, np.inf,
+                                     -4.0 * (V[1:] - V[0]) / denominator)
+        return focal_lengths
+
+    def transform_deflection_gap(self, deflection_angle, offset, left_voltage, right_voltage, spacing):
+        """Propagate a ray across the accelerating gap between two apertures.
+
+        ``left_voltage`` and ``right_voltage`` are the beam voltages on
+        either side of the gap, passed as plain scalars.
+        """
+        if right_voltage <= 0 or left_voltage <= 0:
+            # the ray is decelerated to a stop in the gap; treat the rest of
+            # the gap as a plain drift instead of crashing on the sqrt
+            return 0.0, offset + deflection_angle * spacing
+        voltage_ratio = math.sqrt(left_voltage / right_voltage)
+        outgoing_deflection_angle = deflection_angle * voltage_ratio
+        outgoing_offset = offset + deflection_angle * 2 * spacing / (1 / voltage_ratio + 1)
+        return outgoing_deflection_angle, outgoing_offset
+
+    def transform_deflection_aperture(self, deflection_angle, offset, focal_length):
+        """Apply the thin-lens kick of an aperture to the ray angle."""
+        return deflection_angle - offset / focal_length
+
+    def get_all_offsets_and_deflections(self, angle, offset, energy, voltages,
+                                        focal_lengths=None):
+        """Trace a ray through the whole aperture stack.
+
+        Returns the deflection angle and radial offset at the source plane
+        and after every aperture. Pass ``focal_lengths`` to reuse an already
+        computed set when tracing several rays at the same voltages;
+        otherwise the focal lengths are derived inside the fused kernel.
+        """
+        V = np.asarray(voltages, dtype=np.float64)
+        if focal_lengths is None:
+            deflections, offsets = _propagate_fused(self.spacings, V,
+                                                    float(angle), float(offset), float(energy))
+        else:
+            deflections, offsets = _propagate(self.spacings, V, focal_lengths,
+                                              float(angle), float(offset), float(energy))
+        bad = np.abs(deflections[1:]) > 1.0
+        if bad.any():
+            index = int(np.argmax(bad)) + 1
+            warnings.warn("Paraxial approximation violated at aperture "
+                          f"{index}: {deflections[index]} rad")
+        return deflections, offsets
+
+    def trace_rays(self, angles, offsets, energies, voltages):
+        """Trace a batch of rays through the stack in one vectorized sweep.
+
+        ``angles``, ``offsets`` and ``energies`` are arrays of shape (R,),
+        one entry per ray. The aperture loop stays in Python (only n
+        iterations); each step updates all R rays at once. Returns the
+        deflection and offset histories as arrays of shape (n + 1, R).
+        """
+        focal_lengths = self.get_all_focal_lengths(voltages)
+        V = np.asarray(voltages, dtype=np.float64)
+        n = len(self.spacings)
+        angles = np.atleast_1d(np.asarray(angles, dtype=np.float64))
+        energies = np.asarray(energies, dtype=np.float64)
+        all_deflections = np.empty((n + 1, angles.shape[0]))
+        all_offsets = np.empty((n + 1, angles.shape[0]))
+        all_deflections[0] = angles
+        all_offsets[0] = offsets
+        for i in range(n):
+            voltage_ratio = np.sqrt((V[i] - V[0] + energies) / (V[i + 1] - V[0] + energies))
+            new_offsets = (all_offsets[i]
+                           + all_deflections[i] * 2.0 * self.spacings[i] / (1.0 / voltage_ratio + 1.0))
+            all_deflections[i + 1] = all_deflections[i] * voltage_ratio - new_offsets / focal_lengths[i]
+            all_offsets[i + 1] = new_offsets
+        return all_deflections, all_offsets
+
+    def get_system_focal_length(self, voltages):
+        """Focal length of the whole stack, treating the apertures as thin lenses."""
+        focal_lengths = self.get_all_focal_lengths(voltages)
+        if len(focal_lengths) <= 8:
+            # scalar path: at these sizes the errstate context manager and
+            # ufunc dispatch cost more than the arithmetic itself
+            inverse_sum = 0.0
+            for focal_length in focal_lengths:
+                if focal_length == 0.0:
+                    # an infinitely strong aperture dominates the stack
+                    return 0.0
+                inverse_sum += 1.0 / focal_length
+            return math.inf if inverse_sum == 0.0 else 1.0 / inverse_sum
+        with np.errstate(divide="ignore"):
+            inverse_focal_lengths = 1 / np.asarray(focal_lengths)
+            system_focal_length = 1 / np.sum(inverse_focal_lengths)
+        return system_focal_length
+
+    def linear_ray_path(self, offsets, deflections, number_of_datapoints=10000):
+        """Sample the piecewise-linear ray path for plotting.
+
+        Evaluates all segments in one vectorized pass: each x is assigned to
+        its segment with searchsorted over the cumulative spacings, then the
+        matching linear piece is evaluated directly.
+        """
+        offsets = np.asarray(offsets, dtype=np.float64)
+        n = len(self.spacings)
+        cumulative = self._cum_spacings
+        x = np.linspace(0, 1.0005 * self._total_length, number_of_datapoints)
+        segment = np.clip(np.searchsorted(cumulative, x, side="right") - 1, 0, n)
+        inner = np.minimum(segment, n - 1)
+        slopes = (offsets[1:] - offsets[:-1]) / self.spacings
+        y = offsets[inner] + (x - cumulative[inner]) * slopes[inner]
+        # past the last aperture the ray continues straight at its final angle
+        tail = segment == n
+        y[tail] = offsets[-1] + (x[tail] - cumulative[-1]) * deflections[-1]
+        return x, y
+
+    def plot_custom_ray(self, angle, offset, energy, voltages, number_of_datapoints=10000, ax=None):
+        """Trace one ray and plot it together with the aperture positions.
+
+        Draws into ``ax`` when given (e.g. a Figure owned by the web server);
+        otherwise opens an interactive pyplot window.
+        """
+        show = ax is None
+        if ax is None:
+            ax = plt.figure().add_subplot(111)
+        deflections, offsets = self.get_all_offsets_and_deflections(angle, offset, energy, voltages)
+        x, y = self.linear_ray_path(offsets, deflections, number_of_datapoints)
+        ax.plot(x, y, label="Ray path")
+        # one LineCollection for all aperture markers instead of n axvline
+        # artists, each of which would add its own (mathtext) legend entry
+        y_low = min(float(np.min(y)), 0.0)
+        y_high = max(float(np.max(y)), 0.0)
+        ax.vlines(self._cum_spacings[1:], y_low, y_high, alpha=0.5,
+                  linestyles="dashed", label="Apertures")
+        aperture_voltages = ", ".join(f"{voltages[i + 1]:g} V"
+                                      for i in range(len(self.spacings)))
+        ax.text(0.02, 0.98, "Aperture voltages: " + aperture_voltages,
+                transform=ax.transAxes, va="top", fontsize=8, alpha=0.7)
+        ax.hlines(0, 0, self._total_length, colors="black", alpha=0.3)
+        ax.set_xlabel("Distance along axis (m)")
+        ax.set_ylabel("Radial offset (m)")
+        ax.legend()
+        if show:
+            plt.show()
+
+
+if __name__ == "__main__":
+    chip_v0 = Chip([0.001, 0.001, 0.001, 0.001], [0.0001, 0.0001, 0.0001, 0.0001])
+    print(chip_v0.get_system_focal_length([0, 200, 1000, 200, 50]))
+    chip_v0.plot_custom_ray(0.001, 0, 100, [0, 200, 1000, 200, 50])
+    chip_v0.plot_custom_ray(0, 0.0001, 100, [0, 200, 1000, 200, 50])